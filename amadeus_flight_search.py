@@ -4,24 +4,110 @@
 """
 
 from amadeus import Client, ResponseError
+import atexit
+import csv
+import logging
 import os
+import threading
+import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import traceback
 
-# 從 GitHub Secrets 讀取 API credentials
-try:
-    amadeus = Client(
-        client_id=os.environ.get('AMADEUS_API_KEY'),
-        client_secret=os.environ.get('AMADEUS_API_SECRET')
-    )
-    print("✓ Amadeus API 連接成功")
-except Exception as e:
-    print(f"❌ Amadeus API 連接失敗: {e}")
-    exit(1)
+from cache import cache_key, cache_get, cache_set, cache_prune
 
+# 完整 traceback 只喺 LOG_LEVEL=DEBUG 時先顯示
+logger = logging.getLogger(__name__)
 
-def find_cheap_destinations(origin='HKG', departure_date=None, max_price=5000, duration=None):
+# API 回應快取時間（秒）
+CACHE_TTL = 600
+
+# 同時搜尋嘅最多線程數目，同埋每秒最多 API 請求數目（Amadeus 限制）
+MAX_WORKERS = 8
+MAX_CALLS_PER_SECOND = 10
+
+# 冇數據時用嘅空記錄範本（search_date 喺使用時先加）
+_EMPTY_TEMPLATE = pd.DataFrame({
+    'destination': ['No data found'],
+    'departure_date': [''],
+    'return_date': [''],
+    'price': [0],
+    'note': ['Test environment or no results available']
+})
+
+# 已經開咗嘅 CSV 檔案 {filename: (handle, writer)}
+_csv_writers = {}
+
+# Amadeus client（第一次用先建立）
+_client = None
+_client_lock = threading.Lock()
+
+_rate_lock = threading.Lock()
+_next_call_time = 0.0
+
+# CSV 欄位
+FIELDS = ('destination', 'departure_date', 'return_date', 'price', 'search_date')
+
+
+def _get_client():
+    """
+    攞 Amadeus client（第一次呼叫先建立，之後重用）
+    
+    返回:
+    - amadeus.Client
+    """
+    
+    global _client
+    
+    with _client_lock:
+        if _client is None:
+            # 從 GitHub Secrets 讀取 API credentials
+            api_key = os.environ.get('AMADEUS_API_KEY')
+            api_secret = os.environ.get('AMADEUS_API_SECRET')
+            
+            if not api_key or not api_secret:
+                raise RuntimeError("未設定 AMADEUS_API_KEY 或 AMADEUS_API_SECRET")
+            
+            try:
+                _client = Client(client_id=api_key, client_secret=api_secret)
+            except Exception as e:
+                raise RuntimeError(f"Amadeus API 連接失敗: {e}") from e
+            
+            print("✓ Amadeus API 連接成功")
+    
+    return _client
+
+
+def _throttle():
+    """限制 API 請求速度，每秒最多 MAX_CALLS_PER_SECOND 次"""
+    
+    global _next_call_time
+    
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_call_time - now
+        _next_call_time = max(now, _next_call_time) + 1.0 / MAX_CALLS_PER_SECOND
+    
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _normalize_date(value):
+    """
+    標準化出發日期：date/datetime 轉做 YYYY-MM-DD，字串就原封不動（只去除前後空白）
+    
+    字串可以係單一日期或者日期範圍（例如 "2026-10-22,2026-10-30"），交俾 API 自己驗證
+    """
+    
+    if hasattr(value, 'strftime'):
+        return value.strftime("%Y-%m-%d")
+    return str(value).strip()
+
+
+def find_cheap_destinations(origin='HKG', departure_date=None, max_price=5000, duration=None, verbose=True):
     """
     搵從香港出發嘅平機票目的地
     
@@ -30,36 +116,50 @@ def find_cheap_destinations(origin='HKG', departure_date=None, max_price=5000, d
     - departure_date: 出發日期 (YYYY-MM-DD 格式)
     - max_price: 最高價格（港幣）
     - duration: 旅程日數（例如 7 表示住 7 日）
+    - verbose: 顯示搜尋進度（並行搜尋時關閉，避免輸出混亂；錯誤訊息照樣顯示）
     
     返回:
     - 航班數據列表，或 None（如果出錯）
     """
     
     try:
-        print(f"\n🔍 搜尋參數:")
-        print(f"   出發地: {origin}")
-        print(f"   出發日期: {departure_date if departure_date else '任何日期'}")
-        print(f"   最高價格: HKD ${max_price}")
-        print(f"   旅程日數: {duration if duration else '任何日數'}")
+        if verbose:
+            print(f"\n🔍 搜尋參數:")
+            print(f"   出發地: {origin}")
+            print(f"   出發日期: {departure_date if departure_date else '任何日期'}")
+            print(f"   最高價格: HKD ${max_price}")
+            print(f"   旅程日數: {duration if duration else '任何日數'}")
         
-        # 設定搜尋參數
+        # 設定搜尋參數（標準化，等相同條件會用同一個快取 key）
         params = {
-            'origin': origin,
-            'maxPrice': max_price,
+            'origin': origin.upper(),
+            'maxPrice': int(max_price),
             'viewBy': 'DESTINATION'
         }
         
         if departure_date:
-            params['departureDate'] = departure_date
+            params['departureDate'] = _normalize_date(departure_date)
         
         if duration:
             params['duration'] = duration
         
+        # 先睇下有冇快取
+        key = cache_key('flight_destinations', params)
+        cached = cache_get(key, expire=CACHE_TTL)
+        if cached is not None:
+            if verbose:
+                print("\n⚡ 使用快取結果")
+            return cached
+        
         # 呼叫 Flight Inspiration Search API
-        print("\n📡 正在連接 Amadeus API...")
-        response = amadeus.shopping.flight_destinations.get(**params)
+        if verbose:
+            print("\n📡 正在連接 Amadeus API...")
+        _throttle()
+        response = _get_client().shopping.flight_destinations.get(**params)
         
-        print(f"✓ API 請求成功")
+        if verbose:
+            print(f"✓ API 請求成功")
+        cache_set(key, response.data)
         return response.data
         
     except ResponseError as error:
@@ -74,7 +174,7 @@ def find_cheap_destinations(origin='HKG', departure_date=None, max_price=5000, d
     
     except Exception as e:
         print(f"❌ 未預期嘅錯誤: {e}")
-        traceback.print_exc()
+        logger.debug("find_cheap_destinations failed", exc_info=True)
         return None
 
 
@@ -96,32 +196,152 @@ def search_cheapest_dates(origin='HKG', destination='TYO', departure_date=None):
         print(f"   {origin} → {destination}")
         
         params = {
-            'origin': origin,
-            'destination': destination
+            'origin': origin.upper(),
+            'destination': destination.upper()
         }
         
         if departure_date:
-            params['departureDate'] = departure_date
+            params['departureDate'] = _normalize_date(departure_date)
         
-        response = amadeus.shopping.flight_dates.get(**params)
+        # 先睇下有冇快取
+        key = cache_key('flight_dates', params)
+        cached = cache_get(key, expire=CACHE_TTL)
+        if cached is not None:
+            print(f"⚡ 使用快取結果（{len(cached)} 個日期選項）")
+            return cached
+        
+        _throttle()
+        response = _get_client().shopping.flight_dates.get(**params)
         print(f"✓ 搵到 {len(response.data)} 個日期選項")
+        cache_set(key, response.data)
         return response.data
         
     except ResponseError as error:
         print(f"❌ API 錯誤: {error}")
         return None
+    
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return None
+    
+    except (ValueError, AttributeError) as e:
+        print(f"❌ 搜尋參數錯誤: {e}")
+        return None
+
+
+def find_cheap_destinations_for_dates(dates, origin='HKG', max_price=5000, duration=None):
+    """
+    同時搜尋多個出發日期嘅平機票目的地
+    
+    參數:
+    - dates: 出發日期列表 (YYYY-MM-DD 格式)
+    - origin: 出發地（預設係 HKG = 香港）
+    - max_price: 最高價格（港幣）
+    - duration: 旅程日數
+    
+    返回:
+    - 合併咗嘅航班數據列表（出錯嘅日期會略過）
+    """
+    
+    # 重複嘅日期只搜尋一次（保留原本次序）
+    dates = list(dict.fromkeys(dates))
+    
+    print(f"\n🔍 搜尋參數:")
+    print(f"   出發地: {origin}")
+    print(f"   出發日期: {', '.join(str(d) for d in dates)}")
+    print(f"   最高價格: HKD ${max_price}")
+    print(f"   旅程日數: {duration if duration else '任何日數'}")
+    print("\n📡 正在連接 Amadeus API...")
+    
+    def search_one(date):
+        return find_cheap_destinations(
+            origin=origin,
+            departure_date=date,
+            max_price=max_price,
+            duration=duration,
+            verbose=False
+        )
+    
+    # 網絡請求為主，用線程池並行搜尋
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(search_one, dates))
+    
+    # 全部搜尋完先逐個日期顯示結果
+    combined = []
+    for date, data in zip(dates, results):
+        if data is None:
+            print(f"   {date}: ❌ 搜尋失敗")
+        else:
+            print(f"   {date}: ✓ {len(data)} 個目的地")
+            combined.extend(data)
+    
+    return combined
 
 
-def save_results_to_csv(data, filename='cheap_flights.csv'):
+def _csv_price(flight):
+    """
+    攞 CSV 用嘅價格：冇價格或者唔係數字就留空（pd.read_csv 會讀做 NaN，唔好當係 $0）
     """
-    將結果儲存到 CSV 檔案
+    
+    total = (flight.get('price') or {}).get('total', '')
+    try:
+        float(total)
+    except (TypeError, ValueError):
+        return ''
+    return total
+
+
+def _get_writer(filename):
+    """
+    攞 CSV writer（每個檔案只開一次，程式完結先關閉）
+    
+    參數:
+    - filename: CSV 檔案名稱
+    
+    返回:
+    - csv.DictWriter
+    """
+    
+    if filename not in _csv_writers:
+        handle = open(filename, 'a', newline='', encoding='utf-8', buffering=64 * 1024)
+        writer = csv.DictWriter(handle, FIELDS)
+        
+        # 決定係新建立定係附加到現有檔案
+        if handle.tell() == 0:
+            print(f"   建立新檔案...")
+            writer.writeheader()
+        else:
+            print(f"   檔案已存在，附加新數據...")
+        
+        _csv_writers[filename] = (handle, writer)
+    
+    return _csv_writers[filename][1]
+
+
+def _close_writer(filename=None):
+    """關閉 CSV 檔案 handle（冇指定檔案就全部關閉）"""
+    
+    names = [filename] if filename else list(_csv_writers)
+    for name in names:
+        entry = _csv_writers.pop(name, None)
+        if entry:
+            entry[0].close()
+
+
+atexit.register(_close_writer)
+
+
+def save_results_to_csv(data, filename='cheap_flights.csv', search_date=None):
+    """
+    將結果儲存到 CSV 檔案（舊格式，保留俾向後兼容，分析請改用 Parquet）
     
     參數:
     - data: 航班數據列表
     - filename: CSV 檔案名稱
+    - search_date: 搜尋時間字串（留空就用而家時間，成批記錄共用一個）
     
     返回:
-    - pandas DataFrame 或 None
+    - 儲存咗嘅記錄數目，或 None（如果出錯）
     """
     
     print(f"\n💾 儲存結果到 {filename}...")
@@ -131,52 +351,131 @@ def save_results_to_csv(data, filename='cheap_flights.csv'):
         print("⚠️  冇搵到航班數據，建立空記錄")
         
         # 建立一個空記錄（避免 git commit 錯誤）
-        df = pd.DataFrame([{
-            'destination': 'No data found',
-            'departure_date': '',
-            'return_date': '',
-            'price': 0,
-            'search_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'note': 'Test environment or no results available'
-        }])
+        df = _EMPTY_TEMPLATE.copy()
+        df.insert(4, 'search_date', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         
+        # 會覆蓋成個檔案，先關閉之前開咗嘅 handle
+        _close_writer(filename)
         df.to_csv(filename, index=False)
         print(f"✓ 已建立空記錄檔案")
-        return df
+        return 0
     
-    # 處理正常數據
+    # 處理正常數據（用 csv 模組逐行附加，唔使經 DataFrame）
     try:
-        flights = []
+        now_str = search_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        for flight in data:
-            flights.append({
-                'destination': flight.get('destination', 'Unknown'),
-                'departure_date': flight.get('departureDate', ''),
-                'return_date': flight.get('returnDate', ''),
-                'price': flight.get('price', {}).get('total', 0),
-                'search_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+        writer = _get_writer(filename)
         
-        df = pd.DataFrame(flights)
+        writer.writerows({
+            'destination': flight.get('destination', 'Unknown'),
+            'departure_date': flight.get('departureDate', ''),
+            'return_date': flight.get('returnDate', ''),
+            'price': _csv_price(flight),
+            'search_date': now_str
+        } for flight in data)
         
-        # 按價格排序
-        df = df.sort_values('price')
+        print(f"✓ 成功儲存 {len(data)} 個航班記錄")
         
-        # 決定係新建立定係附加到現有檔案
-        if os.path.exists(filename):
-            print(f"   檔案已存在，附加新數據...")
-            df.to_csv(filename, mode='a', header=False, index=False)
-        else:
-            print(f"   建立新檔案...")
-            df.to_csv(filename, index=False)
+        return len(data)
         
-        print(f"✓ 成功儲存 {len(flights)} 個航班記錄")
+    except Exception as e:
+        print(f"❌ 儲存檔案時出錯: {e}")
+        logger.debug("save_results_to_csv failed", exc_info=True)
+        return None
+
+
+def results_to_dataframe(data, search_date=None):
+    """
+    將 API 回應轉做 DataFrame（俾分析用）
+    
+    參數:
+    - data: 航班數據列表
+    - search_date: 搜尋時間字串（留空就用而家時間）
+    
+    返回:
+    - pandas DataFrame
+    """
+    
+    # 一次過將 API 回應攤平做 DataFrame（price.total 會變成 price_total）
+    df = pd.json_normalize(data, sep='_')
+    df = df.rename(columns={
+        'departureDate': 'departure_date',
+        'returnDate': 'return_date',
+        'price_total': 'price'
+    }).reindex(columns=['destination', 'departure_date', 'return_date', 'price'])
+    
+    df['destination'] = df['destination'].fillna('Unknown')
+    df[['departure_date', 'return_date']] = df[['departure_date', 'return_date']].fillna('')
+    # API 返回嘅價格係字串，轉做 float32 先可以正確排序（冇價格或者格式錯誤會變成 NaN）
+    df['price'] = pd.to_numeric(df['price'], errors='coerce').astype('float32')
+    df['search_date'] = search_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    return df
+
+
+def save_results_to_parquet(data, filename='cheap_flights.parquet', search_date=None):
+    """
+    將結果附加到 Parquet 數據集（每次執行寫一個新檔案到 filename 資料夾）
+    
+    參數:
+    - data: 航班數據列表
+    - filename: Parquet 數據集資料夾名稱
+    - search_date: 搜尋時間字串（留空就用而家時間）
+    
+    返回:
+    - 儲存咗嘅記錄數目，或 None（如果出錯）
+    """
+    
+    print(f"\n💾 儲存結果到 {filename}...")
+    
+    if not data:
+        print("⚠️  冇航班數據，唔使寫入 Parquet")
+        return 0
+    
+    try:
+        df = results_to_dataframe(data, search_date)
+        table = pa.Table.from_pandas(df, preserve_index=False)
         
-        return df
+        # Parquet 唔支援直接附加，每次寫一個新 part 檔案
+        part_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        file_format = ds.ParquetFileFormat()
+        ds.write_dataset(
+            table,
+            filename,
+            format=file_format,
+            file_options=file_format.make_write_options(compression='zstd'),
+            basename_template=f"part-{part_id}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        
+        print(f"✓ 成功儲存 {len(df)} 個航班記錄")
+        
+        return len(df)
         
     except Exception as e:
-        print(f"❌ 儲存檔案時出錯: {e}")
-        traceback.print_exc()
+        print(f"❌ 儲存 Parquet 時出錯: {e}")
+        logger.debug("save_results_to_parquet failed", exc_info=True)
+        return None
+
+
+def load_results_from_parquet(filename='cheap_flights.parquet', search_date=None):
+    """
+    讀取 Parquet 數據集
+    
+    參數:
+    - filename: Parquet 數據集資料夾名稱
+    - search_date: 只讀取呢次搜尋時間嘅記錄（留空就讀取所有歷史記錄）
+    
+    返回:
+    - pandas DataFrame 或 None（如果檔案唔存在或者出錯）
+    """
+    
+    try:
+        filters = [('search_date', '==', search_date)] if search_date else None
+        return pq.read_table(filename, filters=filters).to_pandas()
+        
+    except Exception as e:
+        print(f"❌ 讀取 Parquet 時出錯: {e}")
         return None
 
 
@@ -192,8 +491,8 @@ def analyze_and_display(df):
         print("\n⚠️  冇數據可以顯示")
         return
     
-    # 移除 "No data" 記錄
-    df_valid = df[df['destination'] != 'No data found']
+    # 移除 "No data" 記錄同埋冇價格嘅記錄
+    df_valid = df[(df['destination'] != 'No data found') & df['price'].notna()]
     
     if len(df_valid) == 0:
         print("\n⚠️  冇有效航班數據")
@@ -203,14 +502,14 @@ def analyze_and_display(df):
     print("🎉 最抵機票 TOP 10 🎉")
     print("="*70)
     
-    top_10 = df_valid.head(10)
+    # 只需要最平 10 個，唔使成個 DataFrame 排序
+    top_10 = df_valid.nsmallest(10, 'price')
     
-    for idx, row in enumerate(top_10.iterrows(), 1):
-        row_data = row[1]
-        print(f"\n{idx}. 目的地: {row_data['destination']}")
-        print(f"   💰 價格: HKD ${row_data['price']:.2f}")
-        print(f"   ✈️  出發: {row_data['departure_date']}")
-        print(f"   🔙 返程: {row_data['return_date']}")
+    for idx, row in enumerate(top_10.itertuples(index=False), 1):
+        print(f"\n{idx}. 目的地: {row.destination}")
+        print(f"   💰 價格: HKD ${row.price:.2f}")
+        print(f"   ✈️  出發: {row.departure_date}")
+        print(f"   🔙 返程: {row.return_date}")
     
     print("\n" + "="*70)
     
@@ -236,7 +535,13 @@ def main():
     
     # 出發日期（7 日後出發，你可以改 days=7 為其他數字）
     days_from_now = 7
-    departure_date = (datetime.now() + timedelta(days=days_from_now)).strftime("%Y-%m-%d")
+    
+    # 搜尋幾多日嘅出發日期（1 表示只搜尋一日，例如 30 表示連續搜尋 30 日）
+    search_days = 1
+    departure_dates = [
+        (datetime.now() + timedelta(days=days_from_now + i)).strftime("%Y-%m-%d")
+        for i in range(search_days)
+    ]
     
     # 最高價格（港幣）
     max_price = 3000
@@ -247,15 +552,28 @@ def main():
     # CSV 檔案名稱
     output_file = 'cheap_flights.csv'
     
+    # Parquet 數據集名稱（分析用）
+    parquet_file = 'cheap_flights.parquet'
+    
     # ============================================
     # 執行搜尋
     # ============================================
     
+    # 先建立 API 連接（失敗就直接結束，唔好覆蓋現有嘅 CSV 記錄）
+    try:
+        _get_client()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        exit(1)
+    
+    # 清除過期快取（GitHub Actions 會還原上次嘅快取資料夾）
+    cache_prune(expire=CACHE_TTL)
+    
     try:
         # 搜尋從香港出發嘅平機票
-        results = find_cheap_destinations(
+        results = find_cheap_destinations_for_dates(
+            departure_dates,
             origin='HKG',
-            departure_date=departure_date,
             max_price=max_price,
             duration=duration
         )
@@ -263,7 +581,18 @@ def main():
         # 處理結果
         if results:
             print(f"\n✓ 成功搵到 {len(results)} 個目的地！")
-            df = save_results_to_csv(results, output_file)
+            # 成批記錄共用同一個搜尋時間
+            search_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            save_results_to_csv(results, output_file, search_date)
+            
+            # 分析直接讀取 Parquet 數據集（儲存失敗先用返今次嘅結果）
+            df = None
+            if save_results_to_parquet(results, parquet_file, search_date):
+                df = load_results_from_parquet(parquet_file, search_date)
+            
+            if df is None:
+                df = results_to_dataframe(results, search_date)
+            
             analyze_and_display(df)
         else:
             print("\n⚠️  搵唔到結果")
@@ -281,7 +610,7 @@ def main():
         
     except Exception as e:
         print(f"\n❌ 程式執行失敗: {e}")
-        traceback.print_exc()
+        logger.debug("main failed", exc_info=True)
         
         # 確保建立檔案（避免 GitHub Actions 錯誤）
         try:
@@ -294,5 +623,10 @@ def main():
 
 # 執行主程式
 if __name__ == "__main__":
+    # LOG_LEVEL 唔認識就用 WARNING
+    log_level = logging.getLevelName(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+    if not isinstance(log_level, int):
+        log_level = logging.WARNING
+    logging.basicConfig(level=log_level)
     main()
 
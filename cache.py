@@ -0,0 +1,118 @@
+"""
+Amadeus API 回應快取
+用 JSON 檔案儲存，每個參數組合一個檔案，過咗 TTL 就當無效
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# 快取檔案存放位置
+CACHE_DIR = os.path.join('.cache', 'amadeus')
+
+# 預設快取時間（秒）：機票價格 10 分鐘內當係有效
+DEFAULT_TTL = 600
+
+
+def cache_key(fn, params):
+    """
+    根據函數名稱同參數計算快取 key
+
+    參數:
+    - fn: 函數名稱（字串）
+    - params: 已經標準化嘅參數 dict
+
+    返回:
+    - 十六進位 hash 字串
+    """
+
+    payload = json.dumps({'fn': fn, 'params': params}, sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def cache_get(key, expire=DEFAULT_TTL):
+    """
+    讀取快取
+
+    參數:
+    - key: cache_key() 返回嘅 key
+    - expire: 有效時間（秒）
+
+    返回:
+    - 快取咗嘅數據，或 None（冇快取或者已過期）
+    """
+
+    try:
+        with open(_cache_path(key), encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - entry.get('saved_at', 0) > expire:
+        return None
+
+    return entry.get('data')
+
+
+def cache_set(key, data):
+    """
+    寫入快取（唔會儲存 None，避免將錯誤結果快取落嚟）
+
+    參數:
+    - key: cache_key() 返回嘅 key
+    - data: 要儲存嘅數據（必須可以轉做 JSON）
+    """
+
+    if data is None:
+        return
+
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        # 先寫獨立嘅暫存檔再改名，避免寫到一半被讀取或者多個線程互相覆蓋
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'data': data}, f, ensure_ascii=False)
+        os.replace(tmp_path, _cache_path(key))
+    except (OSError, TypeError, ValueError) as e:
+        print(f"⚠️  寫入快取失敗: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cache_prune(expire=DEFAULT_TTL):
+    """
+    刪除已經過期嘅快取檔案（避免快取資料夾無限增長）
+
+    參數:
+    - expire: 有效時間（秒），檔案最後修改時間超過呢個時間就刪除
+
+    返回:
+    - 刪除咗嘅檔案數目
+    """
+
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return 0
+
+    removed = 0
+    now = time.time()
+
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > expire:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+
+    return removed